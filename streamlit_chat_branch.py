@@ -1,12 +1,31 @@
+import hashlib
 import io
+import json
+import os
+import re
+import shutil
+import threading
+from pathlib import Path
+
 import requests
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from requests.adapters import HTTPAdapter
 from typing import Optional
+from urllib3.util.retry import Retry
 
+try:
+    import orjson
+except ImportError:  # orjson es opcional; stdlib json como fallback
+    orjson = None
 
-def hide_streamlit_elements():
-    """Ocultar elementos de Streamlit UI (Deploy button y opciones del menú)"""
-    hide_style = """
+
+# CSS estático de la UI, compactado una sola vez al importar el módulo
+_HIDE_CSS = re.sub(
+    r"\s+",
+    " ",
+    """
         <style>
         /* Ocultar el botón Deploy */
         [data-testid="stToolbar"] button[kind="header"]:first-child,
@@ -62,8 +81,16 @@ def hide_streamlit_elements():
             font-size: 1.8rem !important;
         }
         </style>
-    """
-    st.markdown(hide_style, unsafe_allow_html=True)
+
+    """,
+)
+
+
+def hide_streamlit_elements():
+    """Ocultar elementos de Streamlit UI (Deploy button y opciones del menú)"""
+    # Reemitir en cada run: el frontend poda los nodos que un rerun no reemite,
+    # así que inyectar una sola vez dejaría la página sin estilos tras el primer rerun
+    st.html(_HIDE_CSS)
 
 
 # API URLs
@@ -72,6 +99,224 @@ API_URL_CONVERSATIONS = f"{API_BASE_URL}/ai/conversations"
 API_URL_ASR = f"{API_BASE_URL}/ai/asr"
 API_URL_TTS = f"{API_BASE_URL}/ai/tts"
 
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Máximo de mensajes renderizados por rerun; los anteriores quedan plegados
+_HISTORY_WINDOW = 40
+
+# Saludo local: evita crear una conversación en el backend solo para saludar
+_GREETING = (
+    "Hello! I'm Pigui, your business intelligence assistant. "
+    "Ask me about your products, sales, customer feedback, or business performance."
+)
+
+
+@dataclass(slots=True)
+class Message:
+    """Mensaje del chat; con slots pesa menos que un dict y el acceso es directo"""
+
+    role: str
+    content: str
+
+
+def _json_loads(content):
+    """Deserializar JSON (orjson si está disponible, stdlib si no)"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def _json_dumps(obj) -> bytes:
+    """Serializar JSON a bytes (orjson si está disponible, stdlib si no)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+# Preguntas sugeridas por sección, con sus keys de widget precalculadas
+_CUSTOMER_QUESTIONS = tuple(
+    (question, f"customer_{question}")
+    for question in (
+        "Who are my most valuable customers?",
+        "What do they buy, when and why?",
+        "Purchase frequency and average ticket",
+        "Behavior before and after a reward",
+        "New vs recurring customers",
+        "Preferences by product, service or branch",
+    )
+)
+
+_SALES_QUESTIONS = tuple(
+    (question, f"sales_{question}")
+    for question in (
+        "Sales by product / service",
+        "Sales by campaign",
+        "Real impact of promotions and rewards",
+        "Best and worst performing products",
+        "Upsell and cross-sell opportunities",
+    )
+)
+
+_MARKETING_QUESTIONS = tuple(
+    (question, f"marketing_{question}")
+    for question in (
+        "Which campaign type works best? (discount, gift, coupon, promo)",
+        "When to launch a campaign?",
+        "Who to target?",
+        "Campaign ROI analysis",
+        "Best channels: email, push notifications, QR",
+    )
+)
+
+_REWARDS_QUESTIONS = tuple(
+    (question, f"rewards_{question}")
+    for question in (
+        "Which rewards work best?",
+        "How much incentive without affecting margin?",
+        "Activation vs retention strategies",
+        "Customer loyalty analysis",
+        "Pigui Points usage and effectiveness",
+    )
+)
+
+_PRODUCTS_QUESTIONS = tuple(
+    (question, f"products_{question}")
+    for question in (
+        "Most and least profitable products",
+        "Margin by product",
+        "Products that attract new customers",
+        "Services that generate recurrence",
+        "Data-driven pricing adjustments",
+    )
+)
+
+_OPERATIONS_QUESTIONS = tuple(
+    (question, f"operations_{question}")
+    for question in (
+        "Performance by branch",
+        "Comparison between branches",
+        "Peak sales hours",
+        "Capacity vs demand analysis",
+        "Operational efficiency metrics",
+    )
+)
+
+_EXPERIENCE_QUESTIONS = tuple(
+    (question, f"experience_{question}")
+    for question in (
+        "Customer feedback analysis",
+        "Friction points in customer journey",
+        "Rewards as part of the experience",
+        "Personalization by customer",
+        "Brand perception and sentiment",
+    )
+)
+
+_GROWTH_QUESTIONS = tuple(
+    (question, f"growth_{question}")
+    for question in (
+        "New customer activation strategies",
+        "Retention and churn analysis",
+        "Organic growth opportunities",
+        "What to scale and what to optimize",
+        "Data-driven decisions, not intuition",
+    )
+)
+
+# (título del expander, caption, preguntas) de cada sección de sugerencias
+QUICK_SECTIONS = (
+    ("👥 Customers & Behavior", "Help me to understand my customers", _CUSTOMER_QUESTIONS),
+    ("💰 Sales & Revenue", "Help me sell more and better", _SALES_QUESTIONS),
+    ("📢 Marketing & Campaigns", "Optimize your marketing strategy and ROI", _MARKETING_QUESTIONS),
+    ("🎁 Rewards & Loyalty", "Maximize customer loyalty and retention", _REWARDS_QUESTIONS),
+    ("📦 Products & Services", "Optimize your product portfolio and pricing", _PRODUCTS_QUESTIONS),
+    ("🏪 Operations & Branch Performance", "Optimize branch efficiency and performance", _OPERATIONS_QUESTIONS),
+    ("⭐ Customer Experience", "Enhance customer satisfaction and loyalty", _EXPERIENCE_QUESTIONS),
+    ("📈 Growth & Strategy", "Scale your business with data-driven decisions", _GROWTH_QUESTIONS),
+)
+
+
+@st.cache_resource(show_spinner=False)
+def get_session() -> requests.Session:
+    """Sesión HTTP compartida para reutilizar conexiones TCP/TLS con el backend"""
+    session = requests.Session()
+    session.headers.update({"Accept": "application/json"})
+    # Reintentos con backoff exponencial ante errores transitorios del backend
+    retry = Retry(
+        total=2,
+        connect=2,
+        read=0,  # no reintentar POSTs cuyo cuerpo ya se envió (idempotencia)
+        backoff_factor=0.5,
+        status_forcelist=[429, 502, 503, 504],
+        allowed_methods=frozenset({"GET", "POST", "PATCH"}),
+        respect_retry_after_header=True,
+    )
+    session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retry))
+
+    # Precalentar la conexión TCP+TLS en segundo plano: la primera llamada
+    # real del usuario no paga el handshake
+    def _warm():
+        try:
+            session.head(API_BASE_URL, timeout=(3.05, 5))
+        except requests.RequestException:
+            pass
+
+    threading.Thread(target=_warm, daemon=True).start()
+    return session
+
+
+# Construir la sesión ya en el import: así el pre-warm arranca antes de que
+# el primer uso real (la carga del sidebar) pida la sesión
+get_session()
+
+
+@st.cache_resource(show_spinner=False)
+def get_pool() -> ThreadPoolExecutor:
+    """Pool de hilos compartido para lanzar llamadas al backend en paralelo"""
+    return ThreadPoolExecutor(max_workers=4)
+
+
+def _submit(fn, *args):
+    """Enviar fn al pool y devolver un futuro de (ok, resultado_o_excepción)
+
+    Los hilos del pool no tienen contexto de script, así que st.error no
+    funciona ahí; las excepciones se devuelven para reportarlas desde el
+    hilo principal.
+    """
+
+    def _call():
+        try:
+            return True, fn(*args)
+        except Exception as e:
+            return False, e
+
+    return get_pool().submit(_call)
+
+
+# Rutas candidatas del avatar; la existente se resuelve una sola vez al importar
+_AVATAR_CANDIDATES = (
+    "scripts/assets/PuguiChat-ziCgELVp.svg",  # Local
+    "assets/PuguiChat-ziCgELVp.svg",  # Docker
+    "./assets/PuguiChat-ziCgELVp.svg",  # Docker alternativo
+)
+_AVATAR_PATH = next((path for path in _AVATAR_CANDIDATES if os.path.exists(path)), None)
+
+
+@st.cache_data(show_spinner=False)
+def _load_avatar() -> Optional[str]:
+    """Leer el avatar SVG una sola vez y servirlo como texto en memoria
+
+    Streamlit acepta el markup SVG directamente, así que cachear el
+    contenido evita releer el archivo en cada mensaje renderizado.
+    Devuelve None si el archivo no existe en ninguna ubicación.
+    """
+    if _AVATAR_PATH is None:
+        return None
+    try:
+        return Path(_AVATAR_PATH).read_text(encoding="utf-8")
+    except OSError:
+        return None
+
 
 def init_state():
     """Inicializar estado de la sesión"""
@@ -87,34 +332,55 @@ def init_state():
     if "user_id" not in st.session_state:
         st.session_state.user_id = query_params.get("user_id", st.session_state.client_id)
 
-    # Conversación actual
-    st.session_state.setdefault("current_conversation_id", None)
+    # Conversación actual (persistida en la URL para sobrevivir al refresh)
+    st.session_state.setdefault("current_conversation_id", query_params.get("conversation_id") or None)
     st.session_state.setdefault("messages", [])
     st.session_state.setdefault("conversations_list", [])
     st.session_state.setdefault("conversations_loaded", False)
+    # Conversaciones con el título en modo edición (O(1) por rerun)
+    st.session_state.setdefault("editing_ids", set())
 
 
-def fetch_conversations(user_id: str, page: int = 1, page_size: int = 20):
-    """Obtener lista de conversaciones del usuario"""
-    try:
-        params = {"user_id": user_id, "status": "active", "page": page, "page_size": page_size}
-        resp = requests.get(API_URL_CONVERSATIONS, params=params, timeout=60)
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get("data", {})
-    except Exception as e:
-        st.error(f"Error loading conversations: {e}")
-        return None
+@st.cache_data(ttl=30, show_spinner=False)
+def _fetch_conversations_cached(user_id: str, page: int, page_size: int):
+    """Pedir la lista de conversaciones al backend (cacheado por usuario/página)"""
+    params = {"user_id": user_id, "status": "active", "page": page, "page_size": page_size}
+    resp = get_session().get(API_URL_CONVERSATIONS, params=params, timeout=(3.05, 30))
+    resp.raise_for_status()
+    data = _json_loads(resp.content)
+    return data.get("data", {})
+
+
+def _normalize_conversations(conversations):
+    """Precalcular los textos del historial lateral al refrescar la lista
+
+    Evita recomputar títulos truncados y captions por conversación en
+    cada rerun del sidebar.
+    """
+    for conv in conversations:
+        title_str = str(conv.get("title") or "Untitled conversation")
+        message_count = conv.get("message_count", 0)
+        conv["_title_str"] = title_str
+        conv["_display_title"] = title_str[:40] + ("..." if len(title_str) > 40 else "")
+        conv["_caption"] = f"{message_count} msgs"
+        conv["_help"] = f"{message_count} messages"
+    return conversations
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_conversation_detail_cached(conversation_id: str):
+    """Pedir el detalle de una conversación al backend (cacheado por id)"""
+    url = f"{API_URL_CONVERSATIONS}/{conversation_id}"
+    resp = get_session().get(url, timeout=(3.05, 30))
+    resp.raise_for_status()
+    data = _json_loads(resp.content)
+    return data.get("data", {})
 
 
 def fetch_conversation_detail(conversation_id: str):
     """Obtener detalle completo de una conversación"""
     try:
-        url = f"{API_URL_CONVERSATIONS}/{conversation_id}"
-        resp = requests.get(url, timeout=60)
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get("data", {})
+        return _fetch_conversation_detail_cached(conversation_id)
     except Exception as e:
         st.error(f"Error loading conversation: {e}")
         return None
@@ -131,17 +397,47 @@ def start_new_conversation(user_id: str, message: str, client_id: str, branch_id
             "client_id": client_id,
             "branch_id": branch_id,
         }
-        resp = requests.post(url, params=params, timeout=120)
+        resp = get_session().post(url, params=params, timeout=(3.05, 90))
         resp.raise_for_status()
-        data = resp.json()
+        data = _json_loads(resp.content)
         return data.get("data", {})
     except Exception as e:
         st.error(f"Error starting conversation: {e}")
         return None
 
 
-def continue_conversation(conversation_id: str, message: str):
-    """Continuar una conversación existente"""
+def _iter_stream_response(resp):
+    """Generar los fragmentos de una respuesta SSE del backend"""
+    try:
+        with resp:
+            if "text/event-stream" not in resp.headers.get("Content-Type", ""):
+                # El backend no soporta streaming: entregar la respuesta completa
+                data = _json_loads(resp.content)
+                yield (data.get("data") or {}).get("response") or ""
+                return
+            for line in resp.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                chunk = line[5:].strip()
+                if chunk == "[DONE]":
+                    break
+                try:
+                    event = _json_loads(chunk)
+                except ValueError:
+                    continue
+                delta = event.get("delta") or event.get("content") or ""
+                if delta:
+                    yield delta
+    except Exception as e:
+        st.error(f"Error continuing conversation: {e}")
+
+
+def continue_conversation(conversation_id: str, message: str, stream: bool = False):
+    """Continuar una conversación existente
+
+    Con stream=True devuelve un generador de fragmentos de texto
+    consumible por st.write_stream; si no, la respuesta completa.
+    """
     try:
         url = f"{API_URL_CONVERSATIONS}/{conversation_id}/continue"
         payload = {
@@ -151,9 +447,13 @@ def continue_conversation(conversation_id: str, message: str):
             "temperature": 0.7,
             "max_tokens": 1024,
         }
-        resp = requests.post(url, json=payload, timeout=120)
+        if stream:
+            payload["stream"] = True
+        resp = get_session().post(url, data=_json_dumps(payload), headers=_JSON_HEADERS, timeout=(3.05, 90), stream=stream)
         resp.raise_for_status()
-        data = resp.json()
+        if stream:
+            return _iter_stream_response(resp)
+        data = _json_loads(resp.content)
         return data.get("data", {})
     except Exception as e:
         st.error(f"Error continuing conversation: {e}")
@@ -165,7 +465,8 @@ def load_conversation(conversation_id: str):
     conversation = fetch_conversation_detail(conversation_id)
     if conversation:
         st.session_state.current_conversation_id = conversation_id
-        st.session_state.messages = [{"role": msg["role"], "content": msg["content"]} for msg in conversation.get("messages", [])]
+        st.query_params["conversation_id"] = conversation_id
+        st.session_state.messages = [Message(role=msg["role"], content=msg["content"]) for msg in conversation.get("messages", [])]
         return True
     return False
 
@@ -175,8 +476,10 @@ def update_conversation_title(conversation_id: str, new_title: str):
     try:
         url = f"{API_URL_CONVERSATIONS}/{conversation_id}"
         payload = {"title": new_title}
-        resp = requests.patch(url, json=payload, timeout=60)
+        resp = get_session().patch(url, data=_json_dumps(payload), headers=_JSON_HEADERS, timeout=(3.05, 30))
         resp.raise_for_status()
+        # El título cambió: la lista cacheada quedó obsoleta
+        _fetch_conversations_cached.clear()
         return True
     except Exception as e:
         st.error(f"Error updating title: {e}")
@@ -188,8 +491,10 @@ def archive_conversation(conversation_id: str):
     try:
         url = f"{API_URL_CONVERSATIONS}/{conversation_id}"
         payload = {"status": "archived"}
-        resp = requests.patch(url, json=payload, timeout=60)
+        resp = get_session().patch(url, data=_json_dumps(payload), headers=_JSON_HEADERS, timeout=(3.05, 30))
         resp.raise_for_status()
+        # La conversación salió del listado activo: invalidar la lista cacheada
+        _fetch_conversations_cached.clear()
         return True
     except Exception as e:
         st.error(f"Error archiving conversation: {e}")
@@ -205,44 +510,92 @@ def start_new_chat():
     # Limpiar estado para nueva conversación
     st.session_state.messages = []
     st.session_state.current_conversation_id = None
+    st.query_params.pop("conversation_id", None)
     st.session_state.conversations_loaded = False
 
 
-def transcribe_audio(audio_bytes: bytes, filename: str, content_type: str) -> Optional[str]:
-    """Transcribir audio a texto"""
-    files = {"file": (filename, audio_bytes, content_type)}
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False)
+def _transcribe_cached(digest: str, _audio_bytes: bytes, filename: str, content_type: str) -> Optional[str]:
+    """Transcribir audio (cacheado por hash del contenido)
+
+    El key de caché es el digest; _audio_bytes va con guion bajo para que
+    Streamlit no vuelva a hashear el buffer completo en cada llamada.
+    """
+    files = {"file": (filename, io.BytesIO(_audio_bytes), content_type)}
+    resp = get_session().post(API_URL_ASR, files=files, timeout=(3.05, 15))
+    resp.raise_for_status()
+    data = _json_loads(resp.content)
+    data = data.get("data") or {}
+    return data.get("text")
+
+
+def transcribe_audio(audio_file, filename: str, content_type: str) -> Optional[str]:
+    """Transcribir audio a texto
+
+    Acepta bytes o un objeto tipo archivo (p. ej. el BytesIO que devuelve
+    st.audio_input). Subidas repetidas del mismo clip se resuelven desde
+    la caché sin volver a llamar al backend.
+    """
+    if isinstance(audio_file, (bytes, bytearray)):
+        audio_bytes = bytes(audio_file)
+    else:
+        audio_bytes = audio_file.read()
+    digest = hashlib.blake2b(audio_bytes, digest_size=16).hexdigest()
     try:
-        resp = requests.post(API_URL_ASR, files=files, timeout=20)
-        resp.raise_for_status()
-        data = resp.json()
-        data = data.get("data") or {}
-        return data.get("text")
-    except requests.RequestException as e:
+        return _transcribe_cached(digest, audio_bytes, filename, content_type)
+    except Exception as e:
         st.error(f"Error during transcription: {e}")
         return None
 
 
-def synthesize_speech(text: str):
-    """Sintetizar texto a voz"""
+@st.cache_data(ttl=86400, max_entries=64, show_spinner=False)
+def _tts_bytes(text: str, voice: str = "nova", model: str = "tts-1-hd", speed: float = 1.0, fmt: str = "mp3") -> bytes:
+    """Descargar el audio TTS (cacheado por texto y parámetros de voz)"""
     payload = {
         "text": text,
-        "model": "tts-1-hd",
-        "voice": "nova",
-        "format": "mp3",
-        "speed": 1.0,
+        "model": model,
+        "voice": voice,
+        "format": fmt,
+        "speed": speed,
     }
+    with get_session().post(API_URL_TTS, data=_json_dumps(payload), headers=_JSON_HEADERS, timeout=(3.05, 60), stream=True) as resp:
+        resp.raise_for_status()
+        # Copia en bloques de 64 KB a nivel C, sin un bucle Python por chunk
+        resp.raw.decode_content = True
+        audio_buffer = io.BytesIO()
+        shutil.copyfileobj(resp.raw, audio_buffer, length=1 << 16)
+        return audio_buffer.getvalue()
+
+
+def _prefetch_tts(text: str):
+    """Precalentar la caché TTS en segundo plano tras una respuesta
+
+    La mayoría de los Play llegan sobre el último mensaje del asistente;
+    sintetizarlo mientras el usuario lee deja el clic en un hit de caché.
+    """
+    _submit(_tts_bytes, text)
+
+
+def synthesize_speech(text: str):
+    """Sintetizar texto a voz"""
     try:
-        with requests.post(API_URL_TTS, json=payload, timeout=60, stream=True) as resp:
-            resp.raise_for_status()
-            audio_buffer = io.BytesIO()
-            for chunk in resp.iter_content(chunk_size=4096):
-                if chunk:
-                    audio_buffer.write(chunk)
-            st.audio(audio_buffer.getvalue(), format="audio/mp3", autoplay=True)
-    except requests.RequestException as e:
+        st.audio(_tts_bytes(text), format="audio/mp3", autoplay=True)
+    except Exception as e:
         st.error(f"Error during voice synthesis: {e}")
 
 
+def _register_completed_turn():
+    """Invalidar cachés y actualizar el contador local tras un turno completado"""
+    _fetch_conversation_detail_cached.clear()
+    _fetch_conversations_cached.clear()
+    for conv in st.session_state.conversations_list:
+        if conv["id"] == st.session_state.current_conversation_id:
+            conv["message_count"] = conv.get("message_count", 0) + 2
+            conv["_caption"] = f"{conv['message_count']} msgs"
+            conv["_help"] = f"{conv['message_count']} messages"
+            break
+
+
 def process_message(message: str):
     """Procesar un mensaje (iniciar o continuar conversación)"""
     user_id = st.session_state.user_id
@@ -253,82 +606,103 @@ def process_message(message: str):
         # Continuar conversación existente
         result = continue_conversation(st.session_state.current_conversation_id, message)
         if result:
+            _register_completed_turn()
             return result.get("response"), result.get("conversation_id")
     else:
         # Iniciar nueva conversación
         result = start_new_conversation(user_id, message, client_id, branch_id)
         if result:
             st.session_state.current_conversation_id = result.get("conversation_id")
+            st.query_params["conversation_id"] = result.get("conversation_id")
+            _fetch_conversations_cached.clear()
+            # Insertar la conversación nueva localmente en vez de refrescar la lista
+            new_conv = {"id": result.get("conversation_id"), "title": None, "message_count": 2}
+            st.session_state.conversations_list.insert(0, _normalize_conversations([new_conv])[0])
             return result.get("response"), result.get("conversation_id")
 
     return None, None
 
 
-def chat_view():
-    """Vista principal del chat"""
-    st.title("Business Intelligence Chat - Pigui AI")
-    st.caption("Ask about your products, sales, customer feedback, and business performance")
+def _prefetch_conversation_details(limit: int = 3):
+    """Precalentar la caché de detalle de las conversaciones más probables
 
-    # Cargar avatar personalizado - buscar en múltiples ubicaciones
-    import os
-
-    possible_paths = [
-        "scripts/assets/PuguiChat-ziCgELVp.svg",  # Local
-        "assets/PuguiChat-ziCgELVp.svg",  # Docker
-        "./assets/PuguiChat-ziCgELVp.svg",  # Docker alternativo
-    ]
-    avatar_path = None
-    for path in possible_paths:
-        if os.path.exists(path):
-            avatar_path = path
-            break
+    Se lanza en el pool tras refrescar la lista: un clic posterior en el
+    historial se resuelve desde _fetch_conversation_detail_cached sin
+    esperar el round-trip al backend.
+    """
+    targets = []
+    if st.session_state.current_conversation_id:
+        targets.append(st.session_state.current_conversation_id)
+    for conv in st.session_state.conversations_list[:limit]:
+        if conv["id"] not in targets:
+            targets.append(conv["id"])
+    for conv_id in targets:
+        _submit(_fetch_conversation_detail_cached, conv_id)
+
+
+def _submit_question(question: str):
+    """Enviar una pregunta sugerida y registrar la respuesta del asistente"""
+    st.session_state.messages.append(Message(role="user", content=question))
+    with st.spinner("Thinking..."):
+        response, _conv_id = process_message(question)
+        if response:
+            st.session_state.messages.append(Message(role="assistant", content=response))
+            _prefetch_tts(response)
+
+
+@st.fragment
+def _render_sidebar():
+    """Sidebar como fragment: sus clics reejecutan solo este bloque
+
+    Los clics que sí cambian el chat principal (cargar conversación,
+    nueva conversación, pregunta sugerida) escalan con
+    st.rerun(scope="app"); el resto se queda en el fragment.
+    """
+    # Lanzar la carga de la lista de conversaciones antes de renderizar
+    conversations_future = None
+    if not st.session_state.conversations_loaded:
+        conversations_future = _submit(_fetch_conversations_cached, st.session_state.user_id, 1, 20)
 
     with st.sidebar:
         # Cargar conversaciones si no están cargadas
-        if not st.session_state.conversations_loaded:
+        if conversations_future is not None:
             with st.spinner("Loading conversations..."):
-                conv_data = fetch_conversations(st.session_state.user_id)
-                if conv_data:
-                    st.session_state.conversations_list = conv_data.get("conversations", [])
+                ok, conv_data = conversations_future.result()
+                if not ok:
+                    st.error(f"Error loading conversations: {conv_data}")
+                elif conv_data:
+                    st.session_state.conversations_list = _normalize_conversations(conv_data.get("conversations", []))
                     st.session_state.conversations_loaded = True
+                    _prefetch_conversation_details()
 
         # Botón para nueva conversación (siempre visible)
         if st.button("➕ New Conversation", use_container_width=True, type="primary"):
             start_new_chat()
-            st.rerun()
+            st.rerun(scope="app")
 
         st.divider()
 
         # Sección 1: Historial de Conversaciones (colapsable)
         total_convs = len(st.session_state.conversations_list)
         # Mantener abierto si alguna conversación está en modo edición
-        is_editing = any(st.session_state.get(f"edit_{conv['id']}", False) for conv in st.session_state.conversations_list)
+        is_editing = bool(st.session_state.editing_ids)
         with st.expander(f"📜 Conversation History ({total_convs})", expanded=is_editing):
             # Mostrar lista de conversaciones
             if st.session_state.conversations_list:
                 for conv in st.session_state.conversations_list:
                     conv_id = conv["id"]
-                    title = conv.get("title") or "Untitled conversation"
-                    message_count = conv.get("message_count", 0)
+                    title_str = conv["_title_str"]
 
                     # Indicador si es la conversación actual
                     is_current = conv_id == st.session_state.current_conversation_id
                     button_type = "primary" if is_current else "secondary"
 
-                    # Formatear título con info (asegurar que title no sea None)
-                    title_str = str(title) if title else "Untitled"
-                    truncated_title = title_str[:40] if len(title_str) > 40 else title_str
-                    display_title = f"{'🔵 ' if is_current else ''}{truncated_title}"
-                    if len(title_str) > 40:
-                        display_title += "..."
-                    display_caption = f"{message_count} msgs"
+                    # Textos precalculados en _normalize_conversations
+                    display_title = ("🔵 " + conv["_display_title"]) if is_current else conv["_display_title"]
+                    display_caption = conv["_caption"]
 
                     # Verificar si está en modo edición
-                    edit_key = f"edit_{conv_id}"
-                    if edit_key not in st.session_state:
-                        st.session_state[edit_key] = False
-
-                    if st.session_state[edit_key]:
+                    if conv_id in st.session_state.editing_ids:
                         # Modo edición: mostrar input y botones
                         new_title = st.text_input(
                             "New title", value=title_str, key=f"input_{conv_id}", label_visibility="collapsed"
@@ -338,13 +712,13 @@ def chat_view():
                             if st.button("✓", key=f"save_{conv_id}", use_container_width=True):
                                 if new_title and new_title != title_str:
                                     if update_conversation_title(conv_id, new_title):
-                                        st.session_state[edit_key] = False
+                                        st.session_state.editing_ids.discard(conv_id)
                                         st.session_state.conversations_loaded = False
-                                        st.rerun()
+                                        st.rerun(scope="fragment")
                         with col2:
                             if st.button("✗", key=f"cancel_{conv_id}", use_container_width=True):
-                                st.session_state[edit_key] = False
-                                st.rerun()
+                                st.session_state.editing_ids.discard(conv_id)
+                                st.rerun(scope="fragment")
                     else:
                         # Modo normal: mostrar botón de conversación
                         col1, col2, col3 = st.columns([5, 1, 1])
@@ -354,233 +728,103 @@ def chat_view():
                                 key=f"conv_{conv_id}",
                                 use_container_width=True,
                                 type=button_type,
-                                help=f"{message_count} messages",
+                                help=conv["_help"],
                             ):
                                 if load_conversation(conv_id):
-                                    st.rerun()
+                                    st.rerun(scope="app")
                         with col2:
                             st.caption(display_caption)
                         with col3:
                             if st.button("✏️", key=f"edit_btn_{conv_id}", help="Edit title"):
-                                st.session_state[edit_key] = True
-                                st.rerun()
+                                st.session_state.editing_ids.add(conv_id)
+                                st.rerun(scope="fragment")
             else:
                 st.info("No previous conversations")
 
         st.divider()
 
-        # Sección 2: Customers & Behavior
-        with st.expander("� Customers & Behavior", expanded=False):
-            st.caption("Help me to understand my customers")
-
-            customer_questions = [
-                "Who are my most valuable customers?",
-                "What do they buy, when and why?",
-                "Purchase frequency and average ticket",
-                "Behavior before and after a reward",
-                "New vs recurring customers",
-                "Preferences by product, service or branch",
-            ]
-
-            for question in customer_questions:
-                if st.button(question, key=f"customer_{question}", use_container_width=True):
-                    st.session_state.messages.append({"role": "user", "content": question})
-                    with st.spinner("Thinking..."):
-                        response, conv_id = process_message(question)
-                        if response:
-                            st.session_state.messages.append({"role": "assistant", "content": response})
-                            st.session_state.conversations_loaded = False
-                    st.rerun()
-
-        # Sección 3: Sales & Revenue
-        with st.expander("💰 Sales & Revenue", expanded=False):
-            st.caption("Help me sell more and better")
-
-            sales_questions = [
-                "Sales by product / service",
-                "Sales by campaign",
-                "Real impact of promotions and rewards",
-                "Best and worst performing products",
-                "Upsell and cross-sell opportunities",
-            ]
-
-            for question in sales_questions:
-                if st.button(question, key=f"sales_{question}", use_container_width=True):
-                    st.session_state.messages.append({"role": "user", "content": question})
-                    with st.spinner("Thinking..."):
-                        response, conv_id = process_message(question)
-                        if response:
-                            st.session_state.messages.append({"role": "assistant", "content": response})
-                            st.session_state.conversations_loaded = False
-                    st.rerun()
-
-        # Sección 4: Marketing & Campaigns
-        with st.expander("📢 Marketing & Campaigns", expanded=False):
-            st.caption("Optimize your marketing strategy and ROI")
-
-            marketing_questions = [
-                "Which campaign type works best? (discount, gift, coupon, promo)",
-                "When to launch a campaign?",
-                "Who to target?",
-                "Campaign ROI analysis",
-                "Best channels: email, push notifications, QR",
-            ]
-
-            for question in marketing_questions:
-                if st.button(question, key=f"marketing_{question}", use_container_width=True):
-                    st.session_state.messages.append({"role": "user", "content": question})
-                    with st.spinner("Thinking..."):
-                        response, conv_id = process_message(question)
-                        if response:
-                            st.session_state.messages.append({"role": "assistant", "content": response})
-                            st.session_state.conversations_loaded = False
-                    st.rerun()
-
-        # Sección 5: Rewards & Loyalty
-        with st.expander("🎁 Rewards & Loyalty", expanded=False):
-            st.caption("Maximize customer loyalty and retention")
-
-            rewards_questions = [
-                "Which rewards work best?",
-                "How much incentive without affecting margin?",
-                "Activation vs retention strategies",
-                "Customer loyalty analysis",
-                "Pigui Points usage and effectiveness",
-            ]
-
-            for question in rewards_questions:
-                if st.button(question, key=f"rewards_{question}", use_container_width=True):
-                    st.session_state.messages.append({"role": "user", "content": question})
-                    with st.spinner("Thinking..."):
-                        response, conv_id = process_message(question)
-                        if response:
-                            st.session_state.messages.append({"role": "assistant", "content": response})
-                            st.session_state.conversations_loaded = False
-                    st.rerun()
-
-        # Sección 6: Products & Services
-        with st.expander("📦 Products & Services", expanded=False):
-            st.caption("Optimize your product portfolio and pricing")
-
-            products_questions = [
-                "Most and least profitable products",
-                "Margin by product",
-                "Products that attract new customers",
-                "Services that generate recurrence",
-                "Data-driven pricing adjustments",
-            ]
-
-            for question in products_questions:
-                if st.button(question, key=f"products_{question}", use_container_width=True):
-                    st.session_state.messages.append({"role": "user", "content": question})
-                    with st.spinner("Thinking..."):
-                        response, conv_id = process_message(question)
-                        if response:
-                            st.session_state.messages.append({"role": "assistant", "content": response})
-                            st.session_state.conversations_loaded = False
-                    st.rerun()
-
-        # Sección 7: Operations & Branch Performance
-        with st.expander("🏪 Operations & Branch Performance", expanded=False):
-            st.caption("Optimize branch efficiency and performance")
-
-            operations_questions = [
-                "Performance by branch",
-                "Comparison between branches",
-                "Peak sales hours",
-                "Capacity vs demand analysis",
-                "Operational efficiency metrics",
-            ]
-
-            for question in operations_questions:
-                if st.button(question, key=f"operations_{question}", use_container_width=True):
-                    st.session_state.messages.append({"role": "user", "content": question})
-                    with st.spinner("Thinking..."):
-                        response, conv_id = process_message(question)
-                        if response:
-                            st.session_state.messages.append({"role": "assistant", "content": response})
-                            st.session_state.conversations_loaded = False
-                    st.rerun()
-
-        # Sección 8: Customer Experience
-        with st.expander("⭐ Customer Experience", expanded=False):
-            st.caption("Enhance customer satisfaction and loyalty")
-
-            experience_questions = [
-                "Customer feedback analysis",
-                "Friction points in customer journey",
-                "Rewards as part of the experience",
-                "Personalization by customer",
-                "Brand perception and sentiment",
-            ]
-
-            for question in experience_questions:
-                if st.button(question, key=f"experience_{question}", use_container_width=True):
-                    st.session_state.messages.append({"role": "user", "content": question})
-                    with st.spinner("Thinking..."):
-                        response, conv_id = process_message(question)
-                        if response:
-                            st.session_state.messages.append({"role": "assistant", "content": response})
-                            st.session_state.conversations_loaded = False
-                    st.rerun()
-
-        # Sección 9: Growth & Strategy
-        with st.expander("📈 Growth & Strategy", expanded=False):
-            st.caption("Scale your business with data-driven decisions")
-
-            growth_questions = [
-                "New customer activation strategies",
-                "Retention and churn analysis",
-                "Organic growth opportunities",
-                "What to scale and what to optimize",
-                "Data-driven decisions, not intuition",
-            ]
-
-            for question in growth_questions:
-                if st.button(question, key=f"growth_{question}", use_container_width=True):
-                    st.session_state.messages.append({"role": "user", "content": question})
-                    with st.spinner("Thinking..."):
-                        response, conv_id = process_message(question)
-                        if response:
-                            st.session_state.messages.append({"role": "assistant", "content": response})
-                            st.session_state.conversations_loaded = False
-                    st.rerun()
-
-    # Mostrar historial de mensajes
-    for i, msg in enumerate(st.session_state.messages):
-        avatar = avatar_path if msg["role"] == "assistant" else None
-        with st.chat_message(msg["role"], avatar=avatar):
-            st.write(msg["content"])
-            if msg["role"] == "assistant":
-                if st.button("🔊 Play", key=f"play_{i}"):
-                    with st.spinner("Generating audio..."):
-                        synthesize_speech(msg["content"])
-
-    # Saludo inicial solo si no hay mensajes Y no hay conversación activa
+        # Secciones de preguntas sugeridas (data-driven, una sola pasada)
+        for section_title, section_caption, section_questions in QUICK_SECTIONS:
+            with st.expander(section_title, expanded=False):
+                st.caption(section_caption)
+
+                for question, key in section_questions:
+                    if st.button(question, key=key, use_container_width=True):
+                        _submit_question(question)
+                        st.rerun(scope="app")
+
+
+@st.fragment
+def _render_message(i: int, msg: Message, avatar_path: Optional[str]):
+    """Renderizar un mensaje como fragment: Play reejecuta solo este bloque"""
+    avatar = avatar_path if msg.role == "assistant" else None
+    with st.chat_message(msg.role, avatar=avatar):
+        st.write(msg.content)
+        if msg.role == "assistant":
+            if st.button("🔊 Play", key=f"play_{i}"):
+                with st.spinner("Generating audio..."):
+                    synthesize_speech(msg.content)
+
+
+def chat_view():
+    """Vista principal del chat"""
+    st.title("Business Intelligence Chat - Pigui AI")
+    st.caption("Ask about your products, sales, customer feedback, and business performance")
+
+    # Avatar personalizado (SVG cacheado en memoria; None si no existe)
+    avatar_path = _load_avatar()
+
+    # Reanudar la conversación de la URL tras un refresh del navegador
+    if st.session_state.current_conversation_id and not st.session_state.messages:
+        if not load_conversation(st.session_state.current_conversation_id):
+            st.session_state.current_conversation_id = None
+
+    # Saludo inicial local; la conversación real se crea con el primer
+    # mensaje del usuario (ver process_message)
     if not st.session_state.messages and not st.session_state.current_conversation_id:
-        with st.spinner("Loading greeting..."):
-            response, conv_id = process_message("Hello")
-            if response:
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                st.session_state.current_conversation_id = conv_id
-                st.session_state.conversations_loaded = False
-                st.rerun()
+        st.session_state.messages.append(Message(role="assistant", content=_GREETING))
+
+    _render_sidebar()
+
+    # Mostrar historial de mensajes (solo la ventana reciente por rerun)
+    older = st.session_state.messages[:-_HISTORY_WINDOW]
+    visible = st.session_state.messages[-_HISTORY_WINDOW:]
+    if older:
+        with st.expander(f"Show earlier ({len(older)} messages)", expanded=False):
+            for msg in older:
+                avatar = avatar_path if msg.role == "assistant" else None
+                with st.chat_message(msg.role, avatar=avatar):
+                    st.write(msg.content)
+    for i, msg in enumerate(visible, start=len(older)):
+        _render_message(i, msg, avatar_path)
 
     # Input del usuario
     if user_prompt := st.chat_input("Ask me anything..."):
         # Agregar mensaje del usuario
-        st.session_state.messages.append({"role": "user", "content": user_prompt})
+        st.session_state.messages.append(Message(role="user", content=user_prompt))
 
         with st.chat_message("user"):
             st.write(user_prompt)
 
         # Procesar mensaje
-        with st.spinner("Thinking..."):
-            response, conv_id = process_message(user_prompt)
-            if response:
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                st.session_state.conversations_loaded = False  # Recargar lista
-                st.rerun()
+        if st.session_state.current_conversation_id:
+            # Streaming: el primer token aparece sin esperar la respuesta completa
+            stream = continue_conversation(st.session_state.current_conversation_id, user_prompt, stream=True)
+            if stream is not None:
+                with st.chat_message("assistant", avatar=avatar_path):
+                    response = st.write_stream(stream)
+                if response:
+                    st.session_state.messages.append(Message(role="assistant", content=response))
+                    _register_completed_turn()
+                    _prefetch_tts(response)
+        else:
+            with st.spinner("Thinking..."):
+                response, conv_id = process_message(user_prompt)
+                if response:
+                    st.session_state.messages.append(Message(role="assistant", content=response))
+                    _prefetch_tts(response)
+                    with st.chat_message("assistant", avatar=avatar_path):
+                        st.write(response)
 
 
 def main():